@@ -0,0 +1,422 @@
+"""
+adaptive_LUTs.py
+
+Accuracy driven refinement of the look up tables (LUTs) used by the 6S
+emulator.
+
+Every LUT node is first scored by leave-one-node-out error (i.e. how badly
+it is predicted by linear interpolation from its neighbours), against a
+surface reflectance error budget. The LUT is then reduced either to a cell
+index (octree-style cells that keep full resolution only where the (a, b)
+coefficients need it) or to a non-uniform grid (only the nodes of each axis
+that are needed), whichever is smaller. Lookups use multilinear
+interpolation from the cell corners.
+
+On the shipped Sentinel 2 LUTs (10 x 9 x 2 x 9 x 4 nodes) with a 0.001
+reflectance budget the non-uniform grid always wins: solar zenith and AOT
+need nearly all of their nodes, H2O often does not.
+
+Usage
+alut = Adaptive_LUT(pickle.load(open(lut_filepath,'rb')), reflectance_error=0.001)
+a, b = alut(solar_z, H2O, O3, AOT, alt)
+report = compare(alut, ilut)
+
+"""
+
+import sys
+import time
+import pickle
+from itertools import product
+import numpy as np
+from scipy.interpolate import RegularGridInterpolator
+
+# LUT input variables, in the order used by the interpolators
+invar_names = ('solar_zs','H2Os','O3s','AOTs','alts')
+
+
+def LUT_grid(LUT):
+  """
+  grid axes and (a, b) values (shape = grid shape + coefficients) of a LUT
+  """
+  invars = LUT['config']['invars']
+  axes = [np.asarray(invars[name], dtype=float) for name in invar_names]
+  shape = [len(axis) for axis in axes]
+  values = np.asarray(LUT['outputs'], dtype=float).reshape(shape+[-1])
+
+  return axes, values
+
+
+def leave_one_out_error(axes, values):
+  """
+  error of each node (per coefficient) when it is left out and linearly
+  interpolated from its neighbours along each axis
+
+  shape = (number of axes,) + values.shape, zero at the ends of each axis
+  """
+  error = np.zeros((len(axes),) + values.shape)
+
+  for d, axis in enumerate(axes):
+    n = len(axis)
+    if n < 3:
+      continue
+
+    below = np.take(values, range(0,n-2), axis=d)
+    node = np.take(values, range(1,n-1), axis=d)
+    above = np.take(values, range(2,n), axis=d)
+
+    # relative position of node between its neighbours
+    w = (axis[1:-1]-axis[:-2])/(axis[2:]-axis[:-2])
+    w = w.reshape([-1 if i == d else 1 for i in range(values.ndim)])
+
+    interior = [d] + [slice(None)]*values.ndim
+    interior[d+1] = slice(1,n-1)
+    error[tuple(interior)] = np.abs(below + w*(above-below) - node)
+
+  return error
+
+
+def coefficient_tolerance(values, reflectance_error):
+  """
+  absolute (a, b) tolerance at each node for a surface reflectance error budget
+
+  SR = (L - a) / b, so an error da gives da / b and an error db gives
+  SR * db / b (i.e. at most db / b for SR <= 1). Half of the budget is given
+  to each coefficient.
+  """
+  b = np.abs(values[...,1:2])
+
+  return np.broadcast_to(0.5 * reflectance_error * b, values.shape)
+
+
+def multilinear(corners, t):
+  """
+  multilinear interpolation from cell corners (shape = (2,)*ndim + coefficients)
+
+  t = list of relative positions (0 to 1) along each axis, each a 1D array
+  """
+  result = corners
+  for d, td in enumerate(t):
+    c0 = np.take(result, [0], axis=d)
+    c1 = np.take(result, [1], axis=d)
+    td = td.reshape([-1 if i == d else 1 for i in range(result.ndim)])
+    result = c0*(1-td) + c1*td
+
+  return result
+
+
+class Adaptive_LUT:
+  """
+  Hierarchical (octree-style) cell index over a 6S emulator LUT.
+
+  Cells are split (along the axes that need it) until multilinear
+  interpolation from their corners reproduces every LUT node inside them
+  to within the surface reflectance error budget, so full grid resolution
+  is only kept where interpolation error needs it.
+
+  The LUT can also be reduced to a non-uniform grid, i.e. only the nodes of
+  each axis that are needed. Whichever of the two is smaller is kept: on
+  coarse grids where most nodes are needed somewhere along solar zenith
+  and AOT, a cell index costs more than the nodes it drops.
+
+  Called like an interpolated LUT (.ilut): alut(solar_z, H2O, O3, AOT, alt)
+
+  NB. not a drop-in replacement for an .ilut: interpolation between nodes
+  is multilinear rather than simplex (Delaunay), which changes results
+  between nodes far more than the refinement does (see compare).
+  """
+
+  def __init__(self, LUT, reflectance_error=0.001):
+
+    self.axes, values = LUT_grid(LUT)
+    self.shape = self.grid_shape = values.shape[:-1]
+    self.reflectance_error = reflectance_error
+
+    # absolute (a, b) tolerance at each node
+    tolerance = coefficient_tolerance(values, reflectance_error)
+
+    # leave-one-node-out analysis (i.e. nodes needed along each axis)
+    needed = np.any(leave_one_out_error(self.axes, values) > tolerance, axis=-1)
+
+    # build cell index (only cell corner nodes are kept)
+    self.dense = False
+    self.leaves = []
+    self.tree = self._build(values, tolerance, needed, (0,)*len(self.shape),
+                            tuple(n-1 for n in self.shape))
+    bounds = np.array(self.leaves, dtype=np.min_scalar_type(max(self.shape)))
+    self.leaf_lo, self.leaf_hi = bounds[:,0], bounds[:,1]
+    del self.leaves
+
+    # kept nodes (sorted flat grid index) and their (a, b) values
+    corners = set()
+    for lo, hi in zip(self.leaf_lo, self.leaf_hi):
+      corners.update(np.ravel_multi_index(np.array(list(product(*zip(lo,hi)))).T, self.shape))
+    self.nodes = np.array(sorted(corners), dtype=np.min_scalar_type(int(np.prod(self.shape))))
+    self.values = values.reshape(-1, values.shape[-1])[self.nodes].copy()
+
+    # non-uniform (dense) grid instead, if it is smaller than the cell index
+    keep = self._subgrid(values, tolerance, needed)
+    subgrid_values = values[np.ix_(*keep)]
+    if subgrid_values.nbytes <= self.nbytes():
+      self.dense = True
+      self.tree = self.nodes = self.leaf_lo = self.leaf_hi = None
+      self.axes = [axis[k] for axis, k in zip(self.axes, keep)]
+      self.shape = subgrid_values.shape[:-1]
+      self.values = subgrid_values.copy()
+
+  def _corner_values(self, lo, hi):
+    """
+    (a, b) values at the corners of a cell, shape = (2,)*ndim + coefficients
+    """
+    if self.dense:
+      return self.values[np.ix_(*[[l,h] for l, h in zip(lo,hi)])]
+
+    corners = np.ravel_multi_index(np.array(list(product(*zip(lo,hi)))).T, self.shape)
+    rows = np.searchsorted(self.nodes, corners)
+
+    return self.values[rows].reshape((2,)*len(lo) + self.values.shape[-1:])
+
+  def _subgrid(self, values, tolerance, needed):
+    """
+    non-uniform grid, i.e. the nodes of each axis that are needed anywhere
+    along that axis (plus its ends), with nodes added back one at a time
+    until every LUT node is within tolerance
+
+    returns kept node indices of each axis
+    """
+    keep = []
+    for d in range(len(self.axes)):
+      k = needed[d].any(axis=tuple(i for i in range(len(self.axes)) if i != d))
+      k[0] = k[-1] = True
+      keep.append(k)
+
+    while True:
+      misfit = np.any(np.abs(self._subgrid_interpolate(values, keep) - values) > tolerance, axis=-1)
+      if not misfit.any():
+        return [np.flatnonzero(k) for k in keep]
+
+      # add back the dropped axis node with the most misfit LUT nodes
+      best = (0, None, None)
+      for d, k in enumerate(keep):
+        counts = misfit.sum(axis=tuple(i for i in range(len(keep)) if i != d))
+        counts[k] = 0
+        if counts.max() > best[0]:
+          best = (counts.max(), d, counts.argmax())
+      keep[best[1]][best[2]] = True
+
+  def _subgrid_interpolate(self, values, keep):
+    """
+    (multilinear) interpolation of every LUT node from the kept nodes only
+    """
+    result = values[np.ix_(*keep)]
+    for d, (axis, k) in enumerate(zip(self.axes, keep)):
+      weights = np.array([np.interp(axis, axis[k], e) for e in np.eye(k.sum())]).T
+      result = np.moveaxis(np.tensordot(weights, result, axes=(1,d)), 0, d)
+
+    return result
+
+  def _split_axes(self, values, tolerance, needed, lo, hi):
+    """
+    axes along which a cell must be split, i.e. those with a node strictly
+    inside the cell that is needed along that axis or that multilinear
+    interpolation from the cell corners gets wrong
+    """
+    cell = tuple(slice(l,h+1) for l, h in zip(lo,hi))
+    corners = values[np.ix_(*[[l,h] for l, h in zip(lo,hi)])]
+    t = [self._relative(d, self.axes[d][l:h+1], l, h) for d, (l, h) in enumerate(zip(lo,hi))]
+    misfit = np.any(np.abs(multilinear(corners, t) - values[cell]) > tolerance[cell], axis=-1)
+
+    split = []
+    for d in range(len(lo)):
+      if hi[d]-lo[d] < 2:
+        continue
+      inside = [slice(None)]*len(lo)
+      inside[d] = slice(1,-1)
+      inside = tuple(inside)
+      if misfit[inside].any() or needed[d][cell][inside].any():
+        split.append(d)
+
+    return split
+
+  def _relative(self, d, x, lo, hi):
+    """
+    relative position of x between grid nodes lo and hi of axis d
+    """
+    span = self.axes[d][hi] - self.axes[d][lo]
+    if span == 0:
+      return np.zeros(np.shape(x))
+    return (np.asarray(x, dtype=float) - self.axes[d][lo]) / span
+
+  def _build(self, values, tolerance, needed, lo, hi):
+    """
+    recursively split a cell (lo, hi = corner grid indices)
+
+    leaf = index into self.leaf_lo, self.leaf_hi
+    branch = (split axes, split indices, children)
+    """
+    splittable = []
+    if any(h-l > 1 for l, h in zip(lo,hi)):
+      splittable = self._split_axes(values, tolerance, needed, lo, hi)
+
+    if not splittable:
+      self.leaves.append((lo, hi))
+      return len(self.leaves)-1
+
+    mids = [(lo[d]+hi[d])//2 for d in splittable]
+    children = []
+    for halves in product((0,1), repeat=len(splittable)):
+      child_lo, child_hi = list(lo), list(hi)
+      for d, mid, half in zip(splittable, mids, halves):
+        if half:
+          child_lo[d] = mid
+        else:
+          child_hi[d] = mid
+      children.append(self._build(values, tolerance, needed, tuple(child_lo), tuple(child_hi)))
+
+    return (splittable, mids, children)
+
+  def lookup(self, x):
+    """
+    (a, b) at a single point x = (solar_z, H2O, O3, AOT, alt)
+    """
+    for d, axis in enumerate(self.axes):
+      if not axis[0] <= x[d] <= axis[-1]:
+        return np.full(self.values.shape[-1], np.nan)
+
+    if self.dense:
+      # grid cell containing x
+      lo = [min(np.searchsorted(axis, x[d], side='right')-1, max(len(axis)-2,0))
+            for d, axis in enumerate(self.axes)]
+      hi = [min(l+1, len(axis)-1) for l, axis in zip(lo, self.axes)]
+    else:
+      node = self.tree
+      while not isinstance(node, int):
+        splittable, mids, children = node
+        child = 0
+        for d, mid in zip(splittable, mids):
+          child = 2*child + int(x[d] >= self.axes[d][mid])
+        node = children[child]
+      lo, hi = self.leaf_lo[node], self.leaf_hi[node]
+
+    corners = self._corner_values(lo, hi)
+    t = [self._relative(d, [x[d]], lo[d], hi[d]) for d in range(len(lo))]
+
+    return multilinear(corners, t).reshape(-1)
+
+  def __call__(self, solar_z, H2O, O3, AOT, alt):
+    """
+    (a, b) coefficients, same call signature and output shape as an .ilut
+    """
+    x = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in (solar_z, H2O, O3, AOT, alt)])
+    points = np.stack([v.reshape(-1) for v in x], axis=-1)
+    result = np.array([self.lookup(point) for point in points])
+
+    return result.reshape(x[0].shape + self.values.shape[-1:])
+
+  def nbytes(self):
+    """
+    memory used by the kept nodes and the cell index arrays
+    """
+    if self.dense:
+      return self.values.nbytes
+    return self.values.nbytes + self.nodes.nbytes + self.leaf_lo.nbytes + self.leaf_hi.nbytes
+
+  def kept_nodes(self):
+    return int(np.prod(self.shape)) if self.dense else len(self.nodes)
+
+  def cells(self):
+    return int(np.prod([max(n-1,1) for n in self.shape])) if self.dense else len(self.leaf_lo)
+
+
+def reflectance_difference(x, reference):
+  """
+  worst-case (a, b) and surface reflectance (SR <= 1) difference of x from
+  reference, ignoring NaN and b = 0 (i.e. no retrieval possible)
+  """
+  valid = np.all(np.isfinite(reference), axis=-1) & (np.abs(reference[:,1]) > 0)
+  difference = np.abs(x - reference)[valid]
+
+  return np.nanmax(difference, axis=0).tolist(),\
+         float(np.nanmax(difference.sum(axis=1)/np.abs(reference[valid,1])))
+
+
+def compare(alut, ilut=None, LUT=None, samples=1000, seed=0):
+  """
+  Memory saved and worst-case error of an Adaptive_LUT compared with the
+  full grid LinearNDInterpolator (.ilut, if given) and the dense grid
+
+  Between nodes the error is split into
+    - refinement: adaptive LUT vs. multilinear interpolation of the full grid
+    - scheme: multilinear vs. simplex (Delaunay) interpolation of the full
+      grid, i.e. the .ilut, which is there even if every node is kept
+
+  reflectance errors are for SR <= 1, i.e. |da| / b + |db| / b, at nodes
+  with b > 0 (i.e. where surface reflectance can be retrieved at all).
+  NaN nodes (i.e. where 6S failed) are ignored.
+  """
+  axes = alut.axes
+  grid_nbytes = int(np.prod(alut.grid_shape)) * alut.values.shape[-1] * alut.values.itemsize
+
+  report = {
+    'reflectance_error':alut.reflectance_error,
+    'dense':alut.dense,
+    'grid_nodes':int(np.prod(alut.grid_shape)),
+    'grid_shape':list(alut.grid_shape),
+    'kept_shape':list(alut.shape) if alut.dense else None,
+    'kept_nodes':alut.kept_nodes(),
+    'cells':alut.cells(),
+    'adaptive_bytes':int(alut.nbytes()),
+    'grid_bytes':grid_nbytes,
+    'memory_saved_vs_grid':1 - alut.nbytes()/grid_nbytes
+  }
+
+  # random points between nodes
+  rng = np.random.RandomState(seed)
+  points = np.column_stack([rng.uniform(axis[0], axis[-1], samples) for axis in axes])
+  t = time.time()
+  adaptive = np.array([alut.lookup(x) for x in points])
+  report['alut_lookup_secs'] = time.time()-t
+
+  if LUT is not None:
+    grid_axes, values = LUT_grid(LUT)
+
+    # worst-case error at the LUT nodes (i.e. against 6S itself)
+    nodes = np.array(list(product(*grid_axes)))
+    at_nodes = np.array([alut.lookup(x) for x in nodes])
+    report['max_node_error'], report['max_node_reflectance_error'] = \
+      reflectance_difference(at_nodes, values.reshape(len(nodes), -1))
+
+    # refinement error, i.e. against full grid multilinear interpolation
+    multilinear_full = RegularGridInterpolator(grid_axes, values)(points)
+    report['max_refinement_error'], report['max_refinement_reflectance_error'] = \
+      reflectance_difference(adaptive, multilinear_full)
+
+  # full grid interpolator (i.e. what the adaptive LUT replaces)
+  if ilut is not None:
+    t = time.time()
+    full = ilut(points)
+    report['ilut_lookup_secs'] = time.time()-t
+
+    report['max_ilut_difference'], report['max_ilut_reflectance_difference'] = \
+      reflectance_difference(adaptive, full)
+    if LUT is not None:
+      report['max_scheme_difference'], report['max_scheme_reflectance_difference'] = \
+        reflectance_difference(multilinear_full, full)
+    report['ilut_bytes'] = len(pickle.dumps(ilut))
+    report['memory_saved_vs_ilut'] = 1 - alut.nbytes()/report['ilut_bytes']
+
+  return report
+
+
+if __name__ == '__main__':
+
+  # python adaptive_LUTs.py path/to/file.lut [path/to/file.ilut] [reflectance_error]
+  LUT = pickle.load(open(sys.argv[1],'rb'))
+  ilut = pickle.load(open(sys.argv[2],'rb')) if len(sys.argv) > 2 else None
+  reflectance_error = float(sys.argv[3]) if len(sys.argv) > 3 else 0.001
+
+  t = time.time()
+  alut = Adaptive_LUT(LUT, reflectance_error)
+  print('Refinement took {:.2f} (secs)'.format(time.time()-t))
+
+  for key, value in compare(alut, ilut, LUT).items():
+    print('{:<34}{}'.format(key, value))
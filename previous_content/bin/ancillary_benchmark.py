@@ -0,0 +1,126 @@
+"""
+ancillary_benchmark.py
+
+Compares the Earth Engine graph of an extractor mapped over an image
+collection (one getInfo() request, as in ee-sentinel2-batch.py) built from
+the per-variable ancillary functions (Atmospheric.water, .ozone, .aerosol and
+FindAssets.getProperties) against the single multi-band stack
+(Atmospheric.ancillary_collection).
+
+Runs offline against a mocked 'ee' module that records every API call, so no
+Earth Engine account is needed.
+
+Usage
+python ancillary_benchmark.py
+
+"""
+
+import os
+import sys
+import types
+from collections import Counter
+
+
+class MockGraph():
+  """
+  Records the Earth Engine API calls made while building a graph
+  """
+
+  def __init__(self):
+    self.calls = Counter()
+    self.requests = 0
+
+  def reset(self):
+    self.calls.clear()
+    self.requests = 0
+
+  def nodes(self):
+    return sum(self.calls.values())
+
+  def reductions(self):
+    return sum(n for name, n in self.calls.items() if name.startswith('reduceRegion'))
+
+
+graph = MockGraph()
+
+
+class MockObject():
+  """
+  Stand-in for any ee object: every method call is a graph node.
+
+  Python functions passed as arguments (e.g. to .map) are traced once with a
+  placeholder argument, as the Earth Engine client library does.
+  """
+
+  def __init__(self, name='ee'):
+    self._name = name
+
+  def __getattr__(self, name):
+    return MockObject(name)
+
+  def __call__(self, *args, **kwargs):
+    if self._name == 'getInfo':
+      graph.requests += 1
+      return {}
+    graph.calls[self._name] += 1
+    for arg in list(args) + list(kwargs.values()):
+      if isinstance(arg, types.FunctionType):
+        arg(MockObject())
+    return MockObject(self._name)
+
+
+def mock_ee():
+  """
+  replace the 'ee' module with a recording mock
+  """
+  ee = MockObject()
+  ee.Initialize = lambda: None
+  sys.modules['ee'] = ee
+  return ee
+
+
+def run():
+  """
+  Print graph size and reductions per scene for each ancillary path
+  """
+
+  ee = mock_ee()
+  sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+  from atmospheric import Atmospheric
+  from helper import FindAssets
+
+  finder = FindAssets()
+  geom = ee.Geometry.Point(-157.816222, 21.297481)
+  ic = ee.ImageCollection('COPERNICUS/S2')
+
+  def per_variable():
+    # i.e. ic.map(extractor).getInfo() with one call per variable
+    def extractor(img):
+      date = ee.Date(img.get('system:time_start'))
+      return ee.Feature(geom,{
+        'h2o':Atmospheric.water(geom,date),
+        'o3':Atmospheric.ozone(geom,date),
+        'aot':Atmospheric.aerosol(geom,date),
+        'alt':finder.getProperties(img,geom).get('altitude')
+      })
+    ic.map(extractor).getInfo()
+
+  def collection_stack():
+    Atmospheric.ancillary_collection(ic,geom).getInfo()
+
+  # the mapped function is traced once, and run server side for every scene
+  print('{:<28}{:>12}{:>28}{:>10}'.format('path (mapped over ic)','graph nodes','reduceRegion(s) per scene','requests'))
+
+  results = {}
+  for name, path in (('per-variable (original)',per_variable),
+                     ('ancillary_collection',collection_stack)):
+    graph.reset()
+    path()
+    results[name] = (graph.nodes(), graph.reductions(), graph.requests)
+    print('{:<28}{:>12}{:>28}{:>10}'.format(name,*results[name]))
+
+  return results
+
+
+if __name__ == '__main__':
+  run()
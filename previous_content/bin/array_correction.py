@@ -0,0 +1,129 @@
+"""
+array_correction.py
+
+Memory-bounded atmospheric correction of Sentinel 2 arrays (e.g. downloaded
+tiles) with the same maths as radiance_from_TOA and atmospheric_correction.
+
+dtype policy
+  - input:   uint16 DN (i.e. top of atmosphere reflectance * 10000)
+  - compute: float32, one reusable block buffer
+  - output:  scaled uint16 (reflectance * scale) or float16 reflectance
+
+The 1/10000 scaling, the Earth-Sun and irradiance multiplier and the (a, b)
+coefficients are folded into a single float32 gain and offset per band:
+
+  SR = (DN / 10000 * multiplier - a) / b = DN * gain + offset
+
+Usage
+gains, offsets = gain_offset(feature, cc, bandNames)# bandNames = order of dn bands
+SR = surface_reflectance(dn, gains, offsets)
+
+"""
+
+import numpy as np
+from radiance import radiance_multiplier
+
+
+def gain_offset(feature, cc, bandNames):
+  """
+  per-band float32 gain and offset, in the order of bandNames (i.e. the
+  band axis of the DN array, e.g. ['B1','B2',...,'B12'])
+  """
+
+  missing = [bandName for bandName in bandNames if bandName not in cc]
+  if missing:
+    raise KeyError('no correction coefficients for bands: {}'.format(missing))
+
+  gains = np.empty(len(bandNames), dtype=np.float32)
+  offsets = np.empty(len(bandNames), dtype=np.float32)
+
+  for i, bandName in enumerate(bandNames):
+
+    multiplier = radiance_multiplier(feature, bandName)
+    a = cc[bandName][0]
+    b = cc[bandName][1]
+
+    gains[i] = multiplier / 10000 / b
+    offsets[i] = -a / b
+
+  return gains, offsets
+
+
+def surface_reflectance(dn, gains, offsets, out=None, dtype=np.uint16,\
+                        scale=10000, dn_nodata=0, out_nodata=None, block_rows=512):
+  """
+  surface reflectance from uint16 DN (bands, rows, cols) or (rows, cols)
+
+  dtype = np.uint16 (or another integer type) gives reflectance * scale and
+  np.float16 gives reflectance. Pixels where DN == dn_nodata are set to
+  out_nodata. For integer output out_nodata must be the lowest or highest
+  value of the dtype (default = lowest) and valid pixels are clipped to
+  the other values, e.g. 1-65535 for uint16, so dark pixels never look like
+  nodata. For float output out_nodata defaults to NaN.
+
+  Computed in float32 one block of rows at a time, so peak extra memory is
+  a single (block_rows, cols) buffer. The output can be the input array
+  itself (out=dn) for a fully in place uint16 correction. A given out must
+  have the shape of dn, it is written directly (never copied).
+  """
+
+  dn = np.asarray(dn)
+  if dn.dtype != np.uint16:
+    raise TypeError('expected uint16 DN, got {}'.format(dn.dtype))
+  single_band = dn.ndim == 2
+  if single_band:
+    dn = dn[np.newaxis]
+
+  bands, rows, cols = dn.shape
+  if out is None:
+    out = np.empty(dn[0].shape if single_band else dn.shape, dtype=dtype)
+  elif out.shape != (dn[0].shape if single_band else dn.shape):
+    raise ValueError('out shape {} does not match DN shape {}'\
+                     .format(out.shape, dn[0].shape if single_band else dn.shape))
+  result = out
+  if single_band:
+    out = out[np.newaxis]# (a view, i.e. still writes to the caller's array)
+
+  integer = np.issubdtype(out.dtype, np.integer)
+  if integer:
+    limits = np.iinfo(out.dtype)
+    low, high = limits.min, limits.max
+    fill = low if out_nodata is None else out_nodata
+    if fill == low:
+      low += 1
+    elif fill == high:
+      high -= 1
+    else:
+      raise ValueError('out_nodata must be {} or {} for {} output, got {}'\
+                       .format(limits.min, limits.max, out.dtype, fill))
+  else:
+    fill = np.nan if out_nodata is None else out_nodata
+
+  # reusable float32 buffers
+  buffer = np.empty((block_rows, cols), dtype=np.float32)
+  invalid = np.empty((block_rows, cols), dtype=bool)
+
+  for band in range(bands):
+
+    gain = np.float32(gains[band] * scale if integer else gains[band])
+    offset = np.float32(offsets[band] * scale if integer else offsets[band])
+
+    for start in range(0, rows, block_rows):
+
+      stop = min(start + block_rows, rows)
+      block = dn[band, start:stop]
+      buf = buffer[:stop-start]
+      mask = invalid[:stop-start]
+
+      np.equal(block, dn_nodata, out=mask)
+      np.multiply(block, gain, out=buf)
+      buf += offset
+
+      if integer:
+        np.rint(buf, out=buf)
+        np.clip(buf, low, high, out=buf)
+
+      buf[mask] = fill
+      out[band, start:stop] = buf
+
+  return result
@@ -8,6 +8,11 @@ H2O = Atmospheric.water(geom,date)
 O3 = Atmospheric.ozone(geom,date)
 AOT = Atmospheric.aerosol(geom,date)
 
+H2O, O3, AOT and altitude in a single request
+ancillary = Atmospheric.ancillary(geom,date)
+features = Atmospheric.ancillary_collection(ic,geom).getInfo()['features']
+cc = se.run(features[0]['properties']['atmcorr_inputs'])
+
 """
 
 
@@ -205,4 +210,115 @@ class Atmospheric():
     AOT = ee.Algorithms.If(AOT,AOT,get_AOT(aerosol_fill(date),geom))
     # i.e. check reduce region worked (else force fill value)
     
-    return AOT
\ No newline at end of file
+    return AOT
+
+
+  def ancillary_image(date):
+    """
+    Multi-band ancillary image (h2o, o3, aot, alt) at time of image
+    aquisition, in the units of the 6S emulator LUTs (i.e. Py6S units,
+    altitude in km).
+
+    Fallbacks are resolved band-wise by masking, i.e. a missing image or a
+    data gap is masked and then unmasked with the fill image, so the whole
+    stack can be sampled with a single reduceRegion (see ancillary_reduce).
+
+    NB. the TOMS gap is applied to the ozone images' own dates (images
+    inside the gap are dropped) rather than to the rounded target date, so
+    a target date just before the end of the gap can use the first TOMS
+    image after it (Atmospheric.ozone would use the fill value).
+    """
+
+    def first_or_masked(ic,bandName):
+      """
+      first image of collection OR a fully masked placeholder (if empty)
+      """
+      placeholder = ee.Image.constant(0).toFloat().rename([bandName]).mask(0)
+      first = ic.limit(1).select([bandName])
+      # mosaic puts later images on top (i.e. real data over placeholder)
+      return ee.ImageCollection([placeholder]).merge(first).mosaic().toFloat()
+
+    # water vapour (6 hour intervals, no fill value)
+    H2O_date = Atmospheric.round_date(date,6)
+    water_ic = ee.ImageCollection('NCEP_RE/surface_wv')\
+                 .filterDate(H2O_date, H2O_date.advance(1,'month'))
+    water = first_or_masked(water_ic,'pr_wtr')\
+              .divide(10)\
+              .rename(['h2o'])
+
+    # ozone (24 hour intervals, avoid TOMS gap entirely)
+    O3_date = Atmospheric.round_date(date,24)
+    ozone_ic = ee.ImageCollection('TOMS/MERGED')\
+                 .filterDate(O3_date, O3_date.advance(1,'month'))\
+                 .filter(ee.Filter.date('1994-11-01','1996-08-01').Not())
+    ozone_fills = ee.ImageCollection('users/samsammurphy/public/ozone_fill').toList(366)
+    jan01 = ee.Date.fromYMD(O3_date.get('year'),1,1)
+    doy_index = date.difference(jan01,'day').toInt()
+    ozone_fill = ee.Image(ozone_fills.get(doy_index)).select(['ozone'])
+    ozone = first_or_masked(ozone_ic,'ozone')\
+              .unmask(ozone_fill)\
+              .divide(1000)\
+              .rename(['o3'])
+
+    # aerosol (MODIS monthly, filled from AOT stack)
+    AOT_fill = ee.Image('users/samsammurphy/public/AOT_stack')\
+                 .select([ee.String('AOT_').cat(date.format('M'))])\
+                 .rename(['AOT_550'])
+    modis_ic = ee.ImageCollection('MODIS/006/MOD08_M3')\
+                 .filterDate(Atmospheric.round_month(date))
+    aerosol = first_or_masked(modis_ic,'Aerosol_Optical_Depth_Land_Mean_Mean_550')\
+                .divide(1000)\
+                .rename(['AOT_550'])\
+                .unmask(AOT_fill)\
+                .rename(['aot'])
+
+    # target altitude (metres to km)
+    altitude = ee.Image('USGS/GMTED2010').divide(1000).rename(['alt'])
+
+    return water.addBands([ozone, aerosol, altitude])
+
+
+  def ancillary_reduce(ancillary_img,centroid):
+    """
+    ancillary values at target, in the native projection of the altitude
+    band (GMTED2010)
+
+    NB. without an explicit crs reduceRegion would use the first band, i.e.
+    a mosaic, whose default projection is 1 degree (~111 km)
+    """
+    return ancillary_img.reduceRegion(reducer=ee.Reducer.mean(),\
+                                      geometry=centroid,\
+                                      crs=ancillary_img.select('alt').projection())
+
+
+  def ancillary(geom,date):
+    """
+    h2o, o3, aot and alt at target from a single reduceRegion
+    """
+    return Atmospheric.ancillary_reduce(Atmospheric.ancillary_image(date),geom.centroid())
+
+
+  def ancillary_collection(ic,geom=None):
+    """
+    6S emulator inputs for every image in a (Sentinel 2) collection, as a
+    feature collection that can be fetched with a single getInfo() request.
+
+    Each feature has 'imgID' and 'atmcorr_inputs' (i.e. solar_z, h2o, o3,
+    aot, alt and doy, the keys read by SixS_emulator.run).
+
+    Uses the image footprint if no target geometry is given.
+    """
+
+    def extractor(img):
+      date = ee.Date(img.get('system:time_start'))
+      target = img.geometry() if geom is None else geom
+      centroid = target.centroid()
+      values = Atmospheric.ancillary_reduce(Atmospheric.ancillary_image(date),centroid)
+      atmcorr_inputs = ee.Dictionary(values).combine({
+        'solar_z':img.get('MEAN_SOLAR_ZENITH_ANGLE'),
+        'doy':date.getRelative('day','year').add(1)
+      })
+      return ee.Feature(centroid,{'imgID':img.get('system:index'),
+                                  'atmcorr_inputs':atmcorr_inputs})
+
+    return ee.FeatureCollection(ic.map(extractor))
@@ -0,0 +1,86 @@
+"""
+dtype_benchmark.py
+
+Memory profile of atmospheric correction per full size Sentinel 2 band
+(10980 x 10980 pixels, i.e. one 10 m band of a tile; peak memory scales
+with the number of bands for the float64 port), comparing
+
+  - float64: (DN / 10000 * multiplier - a) / b, as any straight numpy port
+  - float32 gain/offset pipeline (array_correction.surface_reflectance)
+
+Usage
+python dtype_benchmark.py [bands] [size]
+
+"""
+
+import sys
+import time
+import tracemalloc
+import numpy as np
+from radiance import radiance_multiplier
+from array_correction import gain_offset, surface_reflectance
+
+
+def profile(f, *args, **kwargs):
+  """
+  result, peak extra memory (bytes) and run time of f(*args, **kwargs)
+  """
+  tracemalloc.start()
+  t = time.time()
+  result = f(*args, **kwargs)
+  secs = time.time() - t
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+
+  return result, peak, secs
+
+
+def float64_correction(dn, multipliers, cc, bandNames):
+  """
+  straight port of radiance_from_TOA and atmospheric_correction
+  """
+  SR = []
+  for band, bandName in enumerate(bandNames):
+    a, b = cc[bandName]
+    rad = dn[band] / 10000 * multipliers[band]
+    SR.append((rad - a) / b)
+
+  return np.array(SR)
+
+
+def run(bands=1, size=10980):
+
+  # synthetic scene and (plausible) correction inputs
+  bandNames = ['B{}'.format(i+1) for i in range(bands)]
+  feature = {'properties':{
+    'solar_irradiance':{bandName:1900.0 for bandName in bandNames},
+    'atmcorr_inputs':{'solar_z':35.0,'doy':180}
+  }}
+  cc = {bandName:(20.0, 500.0) for bandName in bandNames}
+  gains, offsets = gain_offset(feature, cc, bandNames)
+  multipliers = [radiance_multiplier(feature, bandName) for bandName in bandNames]
+
+  rng = np.random.RandomState(0)
+  dn = rng.randint(500, 10000, size=(bands, size, size)).astype(np.uint16)
+
+  print('{} band(s) of {} x {} pixels, uint16 input = {:.0f} MB'\
+        .format(bands, size, size, dn.nbytes/1e6))
+  print('{:<34}{:>14}{:>10}'.format('pipeline','peak extra MB','secs'))
+
+  reference, peak, secs = profile(float64_correction, dn, multipliers, cc, bandNames)
+  print('{:<34}{:>14.0f}{:>10.2f}'.format('float64 (DN/10000*m - a)/b', peak/1e6, secs))
+
+  for label, kwargs in (('float32 gain/offset -> uint16', {}),
+                        ('float32 gain/offset -> float16', {'dtype':np.float16}),
+                        ('float32 gain/offset -> in place', {'out':dn.copy()})):
+    SR, peak, secs = profile(surface_reflectance, dn, gains, offsets, **kwargs)
+    scale = 1 if SR.dtype == np.float16 else 10000
+    error = np.abs(SR[:, ::16, ::16].astype(np.float64)/scale - reference[:, ::16, ::16]).max()
+    print('{:<34}{:>14.0f}{:>10.2f}   max error = {:.1e}'.format(label, peak/1e6, secs, error))
+    del SR
+
+
+if __name__ == '__main__':
+  bands = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+  size = int(sys.argv[2]) if len(sys.argv) > 2 else 10980
+  run(bands, size)
@@ -14,6 +14,7 @@ import zipfile
 import time
 from itertools import product
 from scipy.interpolate import LinearNDInterpolator
+from adaptive_LUTs import Adaptive_LUT, compare
 
 
 class Interpolated_LUTs:
@@ -76,15 +77,18 @@ class Interpolated_LUTs:
       '13':'B12',
     }
 
-  def get(self):
+  def get(self, extension='.ilut'):
     """
     Loads interpolated look up tables from local files (if they exist)
+
+    use extension='.alut' for adaptive LUTs (see refine_LUTs), NB. these
+    interpolate multilinearly, not like the .ilut (Delaunay) files
     """
       
     self.iLUTs = {}
     
     # load iLUTs
-    filepaths = glob.glob(self.iLUTs_dir+os.path.sep+'*.ilut')
+    filepaths = glob.glob(self.iLUTs_dir+os.path.sep+'*'+extension)
     if filepaths:
       
       try:
@@ -97,9 +101,9 @@ class Interpolated_LUTs:
 
           self.iLUTs[bandName] = pickle.load(open(f,'rb'))
       except:
-        print('problem loading interpolated look up table (.ilut) files from:\n'+self.iLUTs_dir)      
+        print('problem loading interpolated look up table ({}) files from:\n{}'.format(extension,self.iLUTs_dir))      
     else:
-      print('Looked for iLUTs but did not find in:\n{}'.format(self.iLUTs_dir))
+      print('Looked for {} files but did not find in:\n{}'.format(extension,self.iLUTs_dir))
     
     return self.iLUTs
 
@@ -159,6 +163,57 @@ class Interpolated_LUTs:
       print('LUT files (.lut) not found in LUTs directory, try downloading?')
       
 
+  def refine_LUTs(self, reflectance_error=0.001):
+    """
+    adaptive (error driven) look up tables, saved as .alut
+
+    reflectance_error = surface reflectance error budget at the LUT nodes
+    """
+    
+    filepaths = sorted(glob.glob(self.LUTs_dir+os.path.sep+'*.lut'))
+
+    if filepaths:
+      
+      for fpath in filepaths:
+        
+        fname = os.path.basename(fpath)
+        fid, ext = os.path.splitext(fname)
+        alut_filepath = os.path.join(self.iLUTs_dir,fid+'.alut')
+        ilut_filepath = os.path.join(self.iLUTs_dir,fid+'.ilut')
+        
+        print('Refining: '+fname)
+
+        # load look up table
+        LUT = pickle.load(open(fpath,"rb"))
+
+        t = time.time()
+        alut = Adaptive_LUT(LUT, reflectance_error)
+        print('Refinement took {:.2f} (secs) = '.format(time.time()-t))
+
+        # compare with full grid interpolation (if available)
+        ilut = None
+        if os.path.isfile(ilut_filepath):
+          ilut = pickle.load(open(ilut_filepath,"rb"))
+        report = compare(alut, ilut, LUT)
+        print('adaptive LUT = {} bytes ({:.1%} of the dense grid), max node reflectance error = {:.1e}'\
+              .format(report['adaptive_bytes'],report['adaptive_bytes']/report['grid_bytes'],\
+                      report['max_node_reflectance_error']))
+        if ilut is not None:
+          print('iLUT = {} bytes (adaptive LUT is {:.3%} of that)'\
+                .format(report['ilut_bytes'],report['adaptive_bytes']/report['ilut_bytes']))
+          print('max reflectance difference from iLUT = {:.1e} (refinement {:.1e}, multilinear vs. Delaunay {:.1e})'\
+                .format(report['max_ilut_reflectance_difference'],\
+                        report['max_refinement_reflectance_error'],\
+                        report['max_scheme_reflectance_difference']))
+
+        # save adaptive LUT file
+        pickle.dump(alut, open(alut_filepath, 'wb' ))
+
+    else:
+      
+      print('LUTs directory: ',self.LUTs_dir)
+      print('LUT files (.lut) not found in LUTs directory, try downloading?')
+
   def download_LUTs(self):
     
     # directory for zip file
@@ -202,5 +257,6 @@ class Interpolated_LUTs:
 # iLUTs = Interpolated_LUTs('LANDSAT/LT5_L1T')
 # iLUTs.download_LUTs()
 # iLUTs.interpolate_LUTs()
+# iLUTs.refine_LUTs()
 # iLUTs.get()
 # print(iLUTs.iLUTs)